@@ -1,10 +1,18 @@
 import os
+import fcntl
+import logging
+import tempfile
+import atexit
 import time
+import random
 import threading
-from datetime import datetime, timedelta
-from flask import Flask, jsonify, send_file
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import httpx
+from flask import Flask, jsonify, request, send_file
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from wg_scraper import run_scraper_for_account
 from logger_config import setup_logger, LOGS_DIR, LOG_FILE
@@ -20,97 +28,373 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 # Configuration
 SCRAPER_INTERVAL = 5  # minutes - how often to scrape per account
-QUEUE_CHECK_INTERVAL = 2  # minutes - how often to check for accounts ready to scrape
-MAX_CONCURRENT_SCRAPERS = 10  # max number of accounts to scrape concurrently
+QUEUE_CHECK_INTERVAL = 2  # minutes - fallback wait when no account is due sooner
+MIN_QUEUE_WAIT = 5  # seconds - shortest wait between two queue checks
+CUTOFF_DELTA = timedelta(minutes=SCRAPER_INTERVAL)  # age after which an account is due again
+STATS_HISTORY_SIZE = 100  # recent account runs kept in /stats accounts_processed
+MAX_CONCURRENT_SCRAPERS = int(os.getenv('MAX_CONCURRENT_SCRAPERS', '10'))  # max number of accounts to scrape concurrently
+
+# Columns needed by run_scraper_for_account - avoids pulling whole rows
+ACCOUNT_COLUMNS = 'id,email,password,configuration,message,session_details,listing_data,last_updated_at'
+# Columns returned by the /accounts listing endpoint
+ACCOUNT_LIST_COLUMNS = 'id,email,website,last_updated_at,configuration'
+ACCOUNTS_PAGE_SIZE = 1000  # rows per PostgREST request (matches its default max-rows)
+ACCOUNTS_CACHE_TTL = 15  # seconds - how long account query results are shared between callers
+SUPABASE_TIMEOUT = 10  # seconds - PostgREST request timeout
+SUPABASE_READ_ATTEMPTS = 3  # tries per Supabase read before giving up
 
 app = Flask(__name__)
 
-# Initialize global Supabase client (thread-safe, reusable)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Set to wake the queue thread before its wait runs out (e.g. /scrape/trigger)
+WAKE = threading.Event()
+# Set while the queue thread is processing a batch
+BATCH_RUNNING = threading.Event()
+# Makes the /scrape/trigger check-and-wake atomic across concurrent requests
+TRIGGER_LOCK = threading.Lock()
+
+# Shared worker pool for account scrapes (reused across ticks)
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SCRAPERS, thread_name_prefix='scraper')
+atexit.register(EXECUTOR.shutdown)
+
+def _create_supabase_client() -> Client:
+    """Create a Supabase client. Raises RuntimeError right away if credentials are missing."""
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set in the environment")
+    
+    return create_client(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT)
+    )
+
+
+@lru_cache(maxsize=1)
+def get_supabase() -> Client:
+    """
+    Return the process-wide Supabase client, creating it on first use.
+    
+    The client keeps one pooled keep-alive HTTP connection set, so every
+    caller reuses the same TCP+TLS sessions instead of reconnecting.
+    Used by the queue thread and the Flask endpoints.
+    """
+    return _create_supabase_client()
+
+
+_worker_local = threading.local()
+
+
+def get_worker_supabase() -> Client:
+    """
+    Return the Supabase client of the current scraper worker thread.
+    
+    Each EXECUTOR worker gets its own client (and connection pool), so
+    concurrent scrapers don't queue on a single pool lock. Workers are
+    long-lived, so each client is created once per thread.
+    """
+    client = getattr(_worker_local, 'supabase', None)
+    if client is None:
+        client = _create_supabase_client()
+        _worker_local.supabase = client
+    return client
+
+
+def warm_up_supabase():
+    """Run a tiny query so the TLS session is established before the first scrape tick."""
+    try:
+        get_supabase().table('accounts').select('id').limit(1).execute()
+        logger.info("✅ Supabase connection warmed up")
+    except Exception as e:
+        logger.warning(f"⚠️ Supabase warm-up query failed: {e}")
+
 
 # Global state
-scraper_stats = {
-    'total_runs': 0,
-    'successful_runs': 0,
-    'failed_runs': 0,
-    'total_new_offers': 0,
-    'last_check': None,
-    'currently_running': 0,
-    'accounts_processed': []
-}
-
-
-def get_accounts_ready_to_scrape(supabase: Client):
+class ScraperStats:
+    """Scraper counters shared by the queue thread and the /stats endpoint, guarded by a lock."""
+    
+    def __init__(self, history_size: int = STATS_HISTORY_SIZE):
+        self._lock = threading.RLock()
+        self.total_runs = 0
+        self.successful_runs = 0
+        self.failed_runs = 0
+        self.total_new_offers = 0
+        self.last_check = None
+        self.currently_running = 0
+        # Bounded history - oldest entries drop off automatically
+        self.accounts_processed = deque(maxlen=history_size)
+    
+    def record_check(self, timestamp: str):
+        with self._lock:
+            self.last_check = timestamp
+    
+    def set_running(self, count: int):
+        with self._lock:
+            self.currently_running = count
+    
+    def record_batch(self, results: list, errors: int, timestamp: str):
+        """
+        Fold the outcome of one tick into the counters under a single lock.
+        
+        Args:
+            results: (email, success, new_offers_count) tuples for finished runs
+            errors: Number of runs that raised before returning a result
+            timestamp: ISO timestamp shared by every history entry of this tick
+        """
+        with self._lock:
+            self.failed_runs += errors
+            for email, success, new_offers_count in results:
+                self.total_runs += 1
+                if success:
+                    self.successful_runs += 1
+                    self.total_new_offers += new_offers_count
+                else:
+                    self.failed_runs += 1
+                self.accounts_processed.append({
+                    'email': email,
+                    'timestamp': timestamp,
+                    'new_offers': new_offers_count if success else 0,
+                    'status': 'success' if success else 'failed'
+                })
+    
+    def snapshot(self):
+        """Return a consistent copy of all counters as a plain dict."""
+        with self._lock:
+            return {
+                'total_runs': self.total_runs,
+                'successful_runs': self.successful_runs,
+                'failed_runs': self.failed_runs,
+                'total_new_offers': self.total_new_offers,
+                'last_check': self.last_check,
+                'currently_running': self.currently_running,
+                'accounts_processed': list(self.accounts_processed)
+            }
+
+
+scraper_stats = ScraperStats()
+
+# Parsed ISO timestamps, keyed by the raw string from Supabase
+_ts_cache = {}
+_ts_cache_lock = threading.Lock()
+TS_CACHE_MAX_SIZE = 1024
+
+# Short-lived cache of account queries, keyed by query shape.
+# _accounts_cache_lock only guards the dicts and the generation counter; each
+# key has its own fetch lock, held during the Supabase round-trip
+_accounts_cache = {}
+_accounts_cache_lock = threading.Lock()
+_accounts_fetch_locks = {}
+_accounts_cache_generation = 0
+
+
+def execute_with_retry(query):
+    """
+    Execute a Supabase read, retrying transient transport errors (timeouts,
+    dropped connections) with jittered exponential backoff.
+    
+    The added wait stays well under a second (SUPABASE_READ_ATTEMPTS = 3),
+    so a retried read never pushes into the next queue tick.
+    """
+    for attempt in range(SUPABASE_READ_ATTEMPTS):
+        try:
+            return query.execute()
+        except httpx.TransportError as e:
+            if attempt == SUPABASE_READ_ATTEMPTS - 1:
+                raise
+            delay = 0.1 * (2 ** attempt) + random.random() * 0.1
+            logger.warning(f"⚠️ Supabase read failed ({e.__class__.__name__}), retrying in {delay:.2f}s...")
+            time.sleep(delay)
+
+
+def _fetch_all_pages(build_query):
+    """
+    Execute a query page by page (ACCOUNTS_PAGE_SIZE rows each) so results
+    are never silently truncated by PostgREST's max-rows limit.
+    
+    Rows are ordered by id to keep pages stable.
+    """
+    rows = []
+    offset = 0
+    while True:
+        page = execute_with_retry(build_query().order('id').range(offset, offset + ACCOUNTS_PAGE_SIZE - 1)).data or []
+        rows.extend(page)
+        if len(page) < ACCOUNTS_PAGE_SIZE:
+            return rows
+        offset += ACCOUNTS_PAGE_SIZE
+
+
+def _fetch_accounts(cache_key: str, build_query, fresh: bool = False):
+    """
+    Run an accounts query, sharing the result between callers for ACCOUNTS_CACHE_TTL seconds.
+    
+    A per-key lock is held while querying so concurrent callers on an expired
+    entry wait for one Supabase round-trip instead of each issuing their own,
+    without blocking other keys or invalidate_accounts_cache().
+    
+    Args:
+        cache_key: Identifies the query shape (e.g. 'ready', 'all')
+        build_query: Callable returning the PostgREST query to execute (without range)
+        fresh: If True, bypass the cache and refresh the entry
+    
+    Returns list of account dictionaries.
+    """
+    def cached():
+        with _accounts_cache_lock:
+            entry = _accounts_cache.get(cache_key)
+        if entry and time.monotonic() - entry['ts'] < ACCOUNTS_CACHE_TTL:
+            return entry['data']
+        return None
+    
+    if not fresh:
+        data = cached()
+        if data is not None:
+            return data
+    
+    with _accounts_cache_lock:
+        fetch_lock = _accounts_fetch_locks.setdefault(cache_key, threading.Lock())
+    
+    with fetch_lock:
+        # Re-check: another caller may have refreshed the entry while we waited
+        if not fresh:
+            data = cached()
+            if data is not None:
+                return data
+        
+        with _accounts_cache_lock:
+            generation = _accounts_cache_generation
+        data = _fetch_all_pages(build_query)
+        with _accounts_cache_lock:
+            # Don't store a result that an invalidation made stale mid-fetch
+            if generation == _accounts_cache_generation:
+                _accounts_cache[cache_key] = {'ts': time.monotonic(), 'data': data}
+        return data
+
+
+def invalidate_accounts_cache():
+    """Drop all cached account queries (call after writing to the accounts table)."""
+    global _accounts_cache_generation
+    with _accounts_cache_lock:
+        _accounts_cache.clear()
+        _accounts_cache_generation += 1
+
+
+def parse_timestamp(value: str):
+    """
+    Parse an ISO timestamp from Supabase into a timezone-aware UTC datetime.
+    Naive values are taken as UTC, as Postgres does.
+    
+    Unchanged values (e.g. last_updated_at of an idle account) are served
+    from _ts_cache so repeat ticks skip re-parsing.
+    """
+    with _ts_cache_lock:
+        parsed = _ts_cache.get(value)
+    if parsed is not None:
+        return parsed
+    
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    
+    with _ts_cache_lock:
+        if len(_ts_cache) >= TS_CACHE_MAX_SIZE:
+            _ts_cache.clear()
+        _ts_cache[value] = parsed
+    return parsed
+
+
+def get_accounts_ready_to_scrape(supabase: Client, fresh: bool = False):
     """
     Fetch accounts from Supabase that are:
     1. Website = 'wg-gesucht'
     2. Scraping is enabled (scrape_enabled = true in configuration)
     3. Haven't been updated in the last SCRAPER_INTERVAL minutes
     
+    All three conditions are evaluated by PostgREST, so only ready rows
+    come back over the wire. Results are cached for ACCOUNTS_CACHE_TTL
+    seconds unless fresh=True.
+    
     Returns list of account dictionaries.
     """
+    def build_query():
+        cutoff = (datetime.now(timezone.utc) - CUTOFF_DELTA).isoformat()
+        return (
+            supabase.table('accounts')
+            .select(ACCOUNT_COLUMNS)
+            .eq('website', 'wg-gesucht')
+            .eq('configuration->>scrape_enabled', 'true')
+            .or_(f"last_updated_at.is.null,last_updated_at.lt.{cutoff}")
+        )
+    
     try:
-        # Fetch all wg-gesucht accounts
-        response = supabase.table('accounts').select('*').eq('website', 'wg-gesucht').execute()
+        return _fetch_accounts('ready', build_query, fresh=fresh)
+    
+    except Exception as e:
+        logger.error(f"❌ Error fetching accounts from Supabase: {e}")
+        return []
+
+
+def get_seconds_until_next_ready(supabase: Client):
+    """
+    Seconds until the next scrape-enabled account that is not yet due becomes
+    ready, based on the oldest last_updated_at within the last SCRAPER_INTERVAL.
+    
+    Accounts that are already due are skipped: they were just attempted by this
+    tick, and one that keeps failing (its last_updated_at never moves) must not
+    hold every wait at the QUEUE_CHECK_INTERVAL fallback.
+    
+    Returns None if no account is scheduled or the query fails.
+    """
+    try:
+        cutoff = (datetime.now(timezone.utc) - CUTOFF_DELTA).isoformat()
+        response = execute_with_retry(
+            supabase.table('accounts')
+            .select('last_updated_at')
+            .eq('website', 'wg-gesucht')
+            .eq('configuration->>scrape_enabled', 'true')
+            .gte('last_updated_at', cutoff)
+            .order('last_updated_at')
+            .limit(1)
+        )
         
         if not response.data:
-            return []
-        
-        ready_accounts = []
-        now = datetime.now()
+            return None
         
-        for account in response.data:
-            # Check if scraping is enabled for this account
-            config = account.get('configuration', {})
-            scrape_enabled = config.get('scrape_enabled', False)
-            
-            if not scrape_enabled:
-                logger.info(f"⏭️  Account {account['email']} - scraping disabled (scrape_enabled=false)")
-                continue
-            
-            # Check if account has been updated recently
-            last_updated_str = account.get('last_updated_at')
-            
-            if not last_updated_str:
-                # Never updated - ready to scrape
-                ready_accounts.append(account)
-                continue
-            
-            try:
-                last_updated = datetime.fromisoformat(last_updated_str.replace('Z', '+00:00'))
-                # Remove timezone info for comparison
-                if last_updated.tzinfo is not None:
-                    last_updated = last_updated.replace(tzinfo=None)
-                
-                time_since_update = (now - last_updated).total_seconds() / 60  # minutes
-                
-                if time_since_update >= SCRAPER_INTERVAL:
-                    ready_accounts.append(account)
-                    logger.info(f"✅ Account {account['email']} ready (last updated {time_since_update:.1f} min ago)")
-                else:
-                    logger.info(f"⏳ Account {account['email']} not ready (last updated {time_since_update:.1f} min ago, needs {SCRAPER_INTERVAL - time_since_update:.1f} more min)")
-            
-            except Exception as e:
-                logger.warning(f"⚠️ Error parsing timestamp for {account['email']}: {e}")
-                # If can't parse, consider it ready
-                ready_accounts.append(account)
-        
-        return ready_accounts
+        last_updated = parse_timestamp(response.data[0]['last_updated_at'])
+        return (last_updated + CUTOFF_DELTA - datetime.now(timezone.utc)).total_seconds()
     
     except Exception as e:
-        logger.error(f"❌ Error fetching accounts from Supabase: {e}")
-        return []
+        logger.warning(f"⚠️ Could not determine next ready account: {e}")
+        return None
+
+
+def get_queue_wait_seconds(supabase: Client):
+    """
+    How long the queue thread should wait before its next check.
+    
+    Sleeps until the next account is due (at least MIN_QUEUE_WAIT seconds),
+    but never longer than QUEUE_CHECK_INTERVAL minutes: that cap picks up
+    accounts added or re-enabled while sleeping, and retries overdue (e.g.
+    failing) accounts without a tight loop. Falls back to QUEUE_CHECK_INTERVAL
+    when nothing is scheduled.
+    """
+    seconds = get_seconds_until_next_ready(supabase)
+    
+    if seconds is None:
+        return QUEUE_CHECK_INTERVAL * 60
+    
+    return min(max(MIN_QUEUE_WAIT, seconds), QUEUE_CHECK_INTERVAL * 60)
 
 
 def process_account(account: dict):
     """
     Process a single account - run scraper and update stats.
-    Uses global supabase client (thread-safe).
+    Runs on an EXECUTOR worker and uses that thread's client from get_worker_supabase().
     
     Returns: (account_email, success, new_offers_count)
     """
     try:
-        success, new_offers_count = run_scraper_for_account(account, supabase)
+        success, new_offers_count = run_scraper_for_account(account, get_worker_supabase())
+        if success:
+            # last_updated_at changed - cached "ready" results are now stale
+            invalidate_accounts_cache()
         return (account['email'], success, new_offers_count)
     except Exception as e:
         logger.error(f"❌ Error processing account {account['email']}: {e}")
@@ -119,90 +403,146 @@ def process_account(account: dict):
 
 def scraper_queue_thread():
     """
-    Background thread that checks for accounts ready to scrape every QUEUE_CHECK_INTERVAL minutes.
+    Background thread that checks for accounts ready to scrape.
+    After each check it waits until the next account is due (see get_queue_wait_seconds)
+    or until WAKE is set by /scrape/trigger.
     Processes up to MAX_CONCURRENT_SCRAPERS accounts concurrently.
-    Uses global supabase client (thread-safe).
+    Uses the shared Supabase client from get_supabase().
     """
     logger.info(f"🚀 Scraper queue thread started!")
-    logger.info(f"   - Checking every {QUEUE_CHECK_INTERVAL} minutes")
+    logger.info(f"   - Checking when the next account is due (fallback every {QUEUE_CHECK_INTERVAL} minutes)")
     logger.info(f"   - Scraping accounts every {SCRAPER_INTERVAL} minutes")
     logger.info(f"   - Max concurrent scrapers: {MAX_CONCURRENT_SCRAPERS}")
     
     while True:
         try:
-            logger.info(f"\n{'='*60}")
-            logger.info(f"🔍 Checking for accounts ready to scrape...")
-            logger.info(f"{'='*60}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"\n{'='*60}")
+                logger.debug(f"🔍 Checking for accounts ready to scrape...")
+                logger.debug(f"{'='*60}")
             
-            scraper_stats['last_check'] = datetime.now().isoformat()
+            tick_now_iso = datetime.now(timezone.utc).isoformat()
+            scraper_stats.record_check(tick_now_iso)
             
-            ready_accounts = get_accounts_ready_to_scrape(supabase)
+            # Always query: the tick is timed to when an account becomes due, which a
+            # cached list from an earlier tick would miss (the fresh result refills the cache)
+            ready_accounts = get_accounts_ready_to_scrape(get_supabase(), fresh=True)
             
             if not ready_accounts:
                 logger.info("✅ No accounts ready to scrape at this time.")
             else:
-                logger.info(f"📋 Found {len(ready_accounts)} accounts ready to scrape")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"📋 Ready accounts: {', '.join(acc['email'] for acc in ready_accounts)}")
                 
-                # Process accounts concurrently using ThreadPoolExecutor
-                with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SCRAPERS) as executor:
-                    # Submit all tasks
-                    future_to_account = {
-                        executor.submit(process_account, account): account 
-                        for account in ready_accounts
-                    }
-                    
-                    scraper_stats['currently_running'] = len(future_to_account)
-                    
-                    # Process completed tasks
-                    for future in as_completed(future_to_account):
-                        account = future_to_account[future]
-                        try:
-                            email, success, new_offers_count = future.result()
-                            
-                            scraper_stats['total_runs'] += 1
-                            
-                            if success:
-                                scraper_stats['successful_runs'] += 1
-                                scraper_stats['total_new_offers'] += new_offers_count
-                                scraper_stats['accounts_processed'].append({
-                                    'email': email,
-                                    'timestamp': datetime.now().isoformat(),
-                                    'new_offers': new_offers_count,
-                                    'status': 'success'
-                                })
-                                logger.info(f"✅ Account {email} processed successfully ({new_offers_count} new offers)")
-                            else:
-                                scraper_stats['failed_runs'] += 1
-                                scraper_stats['accounts_processed'].append({
-                                    'email': email,
-                                    'timestamp': datetime.now().isoformat(),
-                                    'new_offers': 0,
-                                    'status': 'failed'
-                                })
-                                logger.error(f"❌ Account {email} processing failed")
+                BATCH_RUNNING.set()
+                
+                # Submit all tasks to the shared executor
+                future_to_account = {
+                    EXECUTOR.submit(process_account, account): account 
+                    for account in ready_accounts
+                }
+                
+                scraper_stats.set_running(len(future_to_account))
+                
+                # Collect results first, then fold them into the stats in one go
+                results = []
+                errors = 0
+                for future in as_completed(future_to_account):
+                    account = future_to_account[future]
+                    try:
+                        email, success, new_offers_count = future.result()
+                        results.append((email, success, new_offers_count))
                         
-                        except Exception as e:
-                            scraper_stats['failed_runs'] += 1
-                            logger.error(f"❌ Exception processing account {account['email']}: {e}")
+                        if not success:
+                            logger.error(f"❌ Account {email} processing failed")
+                        elif logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f"✅ Account {email} processed successfully ({new_offers_count} new offers)")
                     
-                    scraper_stats['currently_running'] = 0
+                    except Exception as e:
+                        errors += 1
+                        logger.error(f"❌ Exception processing account {account['email']}: {e}")
                 
-                # Keep only last 100 processed accounts in memory
-                if len(scraper_stats['accounts_processed']) > 100:
-                    scraper_stats['accounts_processed'] = scraper_stats['accounts_processed'][-100:]
+                scraper_stats.record_batch(results, errors, tick_now_iso)
+                scraper_stats.set_running(0)
                 
-                logger.info(f"\n📊 Batch Summary:")
-                logger.info(f"   Total runs: {scraper_stats['total_runs']}")
-                logger.info(f"   Successful: {scraper_stats['successful_runs']}")
-                logger.info(f"   Failed: {scraper_stats['failed_runs']}")
-                logger.info(f"   Total new offers found: {scraper_stats['total_new_offers']}")
+                succeeded = sum(1 for _, success, _ in results if success)
+                new_offers = sum(n for _, success, n in results if success)
+                summary = scraper_stats.snapshot()
+                logger.info(
+                    "📊 Tick: ready=%d succeeded=%d failed=%d new_offers=%d | totals: runs=%d failed=%d new_offers=%d",
+                    len(ready_accounts), succeeded, len(ready_accounts) - succeeded, new_offers,
+                    summary['total_runs'], summary['failed_runs'], summary['total_new_offers']
+                )
         
         except Exception as e:
             logger.error(f"❌ Error in scraper queue thread: {e}")
         
-        # Wait for next check interval
-        logger.info(f"\n⏳ Waiting {QUEUE_CHECK_INTERVAL} minutes until next check...")
-        time.sleep(QUEUE_CHECK_INTERVAL * 60)
+        BATCH_RUNNING.clear()
+        
+        # Wait until the next account is due, or until woken by /scrape/trigger
+        wait_seconds = get_queue_wait_seconds(get_supabase())
+        logger.info("⏳ Waiting %.0f seconds until next check...", wait_seconds)
+        WAKE.wait(timeout=wait_seconds)
+        WAKE.clear()
+
+
+# Resolved once - download_log checks requested paths against it
+LOGS_DIR_REALPATH = os.path.realpath(LOGS_DIR)
+
+# Lock file that makes sure only one process (e.g. one gunicorn worker) runs the queue
+SCRAPER_LOCK_FILE = os.getenv('SCRAPER_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'wg_scraper.lock'))
+
+_scraper_thread = None
+_scraper_thread_lock = threading.Lock()
+_queue_lock_file = None
+
+
+def _acquire_queue_lock():
+    """
+    Take a non-blocking exclusive flock on SCRAPER_LOCK_FILE.
+    
+    Returns the open lock file (keep it open to hold the lock), or None if
+    another process already owns the queue. The OS releases the lock when
+    the owning process exits.
+    """
+    lock_file = open(SCRAPER_LOCK_FILE, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def start_scraper_thread():
+    """
+    Start the background scraper queue thread.
+    
+    Safe to call from every entrypoint (app.py, serve.py, gunicorn workers):
+    - only one thread is started per process
+    - only the process holding SCRAPER_LOCK_FILE runs the queue
+    - under the Flask reloader, only the serving child process starts it
+    
+    Returns the thread, or None if this process doesn't own the queue.
+    """
+    global _scraper_thread, _queue_lock_file
+    
+    if app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return None
+    
+    with _scraper_thread_lock:
+        if _scraper_thread is not None and _scraper_thread.is_alive():
+            return _scraper_thread
+        
+        if _queue_lock_file is None:
+            _queue_lock_file = _acquire_queue_lock()
+            if _queue_lock_file is None:
+                logger.info(f"⏭️  Scraper queue already running in another process (lock: {SCRAPER_LOCK_FILE})")
+                return None
+        
+        _scraper_thread = threading.Thread(target=scraper_queue_thread, name='scraper-queue', daemon=True)
+        _scraper_thread.start()
+        return _scraper_thread
 
 
 # ===================================================
@@ -223,25 +563,37 @@ def index():
 def stats():
     """Get scraper statistics."""
     return jsonify({
-        'stats': scraper_stats,
+        'stats': scraper_stats.snapshot(),
         'config': {
             'scraper_interval_minutes': SCRAPER_INTERVAL,
             'queue_check_interval_minutes': QUEUE_CHECK_INTERVAL,
-            'max_concurrent_scrapers': MAX_CONCURRENT_SCRAPERS
+            'max_concurrent_scrapers': MAX_CONCURRENT_SCRAPERS,
+            'stats_history_size': STATS_HISTORY_SIZE
         }
     })
 
 
 @app.route('/accounts')
 def accounts():
-    """Get all wg-gesucht accounts from Supabase."""
+    """Get all wg-gesucht accounts from Supabase. Pass ?count_only=1 to get just the count."""
     try:
-        response = supabase.table('accounts').select('id, email, website, last_updated_at, configuration').eq('website', 'wg-gesucht').execute()
+        if request.args.get('count_only') == '1':
+            # Exact count from PostgREST's Content-Range header, without the row bodies
+            response = execute_with_retry(get_supabase().table('accounts').select('id', count='exact').eq('website', 'wg-gesucht').limit(1))
+            return jsonify({
+                'success': True,
+                'count': response.count
+            })
+        
+        account_rows = _fetch_accounts(
+            'all',
+            lambda: get_supabase().table('accounts').select(ACCOUNT_LIST_COLUMNS).eq('website', 'wg-gesucht')
+        )
         
         return jsonify({
             'success': True,
-            'count': len(response.data),
-            'accounts': response.data
+            'count': len(account_rows),
+            'accounts': account_rows
         })
     except Exception as e:
         return jsonify({
@@ -252,9 +604,10 @@ def accounts():
 
 @app.route('/accounts/ready')
 def accounts_ready():
-    """Get accounts that are ready to be scraped."""
+    """Get accounts that are ready to be scraped. Pass ?fresh=1 to bypass the cache."""
     try:
-        ready_accounts = get_accounts_ready_to_scrape(supabase)
+        fresh = request.args.get('fresh') == '1'
+        ready_accounts = get_accounts_ready_to_scrape(get_supabase(), fresh=fresh)
         
         return jsonify({
             'success': True,
@@ -277,30 +630,37 @@ def accounts_ready():
 
 @app.route('/scrape/trigger', methods=['POST'])
 def trigger_scrape():
-    """Manually trigger a scrape check (useful for testing)."""
+    """
+    Manually trigger a scrape check (useful for testing).
+    
+    Returns 409 if a batch is already running or a trigger is already pending,
+    so rapid repeated POSTs don't queue duplicate scrapes.
+    """
     try:
-        ready_accounts = get_accounts_ready_to_scrape(supabase)
-        
-        if not ready_accounts:
+        if _scraper_thread is None or not _scraper_thread.is_alive():
             return jsonify({
-                'success': True,
-                'message': 'No accounts ready to scrape',
-                'count': 0
-            })
-        
-        # Process accounts in a separate thread to not block the request
-        def async_scrape():
-            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SCRAPERS) as executor:
-                futures = [executor.submit(process_account, account) for account in ready_accounts]
-                for future in as_completed(futures):
-                    try:
-                        future.result()
-                    except Exception as e:
-                        logger.error(f"Error in async scrape: {e}")
+                'success': False,
+                'error': 'Scraper queue is not running in this process'
+            }), 503
         
-        thread = threading.Thread(target=async_scrape)
-        thread.daemon = True
-        thread.start()
+        with TRIGGER_LOCK:
+            if WAKE.is_set() or BATCH_RUNNING.is_set():
+                return jsonify({
+                    'success': False,
+                    'error': 'Scrape already running'
+                }), 409
+            
+            ready_accounts = get_accounts_ready_to_scrape(get_supabase(), fresh=True)
+            
+            if not ready_accounts:
+                return jsonify({
+                    'success': True,
+                    'message': 'No accounts ready to scrape',
+                    'count': 0
+                })
+            
+            # Wake the queue thread so it picks the ready accounts up right away
+            WAKE.set()
         
         return jsonify({
             'success': True,
@@ -326,18 +686,22 @@ def list_logs():
                 'message': 'No logs directory found yet'
             })
         
+        # scandir entries carry cached stat data, avoiding one os.stat call per file
+        with os.scandir(LOGS_DIR) as it:
+            entries = [entry for entry in it if entry.name.startswith('scraper.log')]
+        entries.sort(key=lambda entry: entry.name, reverse=True)
+        
         log_files = []
-        for filename in sorted(os.listdir(LOGS_DIR), reverse=True):
-            if filename.startswith('scraper.log'):
-                filepath = os.path.join(LOGS_DIR, filename)
-                file_stats = os.stat(filepath)
-                log_files.append({
-                    'filename': filename,
-                    'size_bytes': file_stats.st_size,
-                    'size_mb': round(file_stats.st_size / (1024 * 1024), 2),
-                    'modified': datetime.fromtimestamp(file_stats.st_mtime).isoformat(),
-                    'download_url': f'/logs/download/{filename}'
-                })
+        for entry in entries:
+            file_stats = entry.stat(follow_symlinks=False)
+            size_bytes = file_stats.st_size
+            log_files.append({
+                'filename': entry.name,
+                'size_bytes': size_bytes,
+                'size_mb': round(size_bytes / (1024 * 1024), 2) if size_bytes >= 1024 * 1024 else 0.0,
+                'modified': datetime.fromtimestamp(file_stats.st_mtime).isoformat(),
+                'download_url': f'/logs/download/{entry.name}'
+            })
         
         return jsonify({
             'success': True,
@@ -357,37 +721,39 @@ def list_logs():
 def download_log(filename=None):
     """Download a log file. Default: current log file."""
     try:
-        if not os.path.exists(LOGS_DIR):
-            return jsonify({
-                'success': False,
-                'error': 'No logs directory found'
-            }), 404
-        
         # If no filename provided, download the current log
         if filename is None:
             filename = 'scraper.log'
         
-        # Security: Only allow downloading scraper.log files
-        if not filename.startswith('scraper.log'):
+        # Security: Only allow scraper.log files that resolve inside LOGS_DIR
+        # (realpath also catches '..' segments and symlinks pointing elsewhere)
+        filepath = os.path.realpath(os.path.join(LOGS_DIR, filename))
+        if not filename.startswith('scraper.log') or not filepath.startswith(LOGS_DIR_REALPATH + os.sep):
             return jsonify({
                 'success': False,
                 'error': 'Invalid log file name'
             }), 400
         
-        filepath = os.path.join(LOGS_DIR, filename)
-        
-        if not os.path.exists(filepath):
-            return jsonify({
-                'success': False,
-                'error': f'Log file {filename} not found'
-            }), 404
-        
-        return send_file(
+        # Rotated files never change, so clients can revalidate (ETag/If-Modified-Since)
+        # and resume with Range requests. The live log keeps growing - always send it in full.
+        is_live_log = filename == 'scraper.log'
+        response = send_file(
             filepath,
             as_attachment=True,
             download_name=filename,
-            mimetype='text/plain'
+            mimetype='text/plain',
+            conditional=not is_live_log,
+            etag=not is_live_log
         )
+        response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+        return response
+    
+    except FileNotFoundError:
+        # A missing file (or logs directory) surfaces from send_file's own stat
+        return jsonify({
+            'success': False,
+            'error': f'Log file {filename} not found'
+        }), 404
     
     except Exception as e:
         return jsonify({
@@ -401,9 +767,12 @@ def download_log(filename=None):
 # ===================================================
 
 if __name__ == '__main__':
+    # Fail fast on missing credentials and open the connection up front
+    get_supabase()
+    warm_up_supabase()
+    
     # Start background scraper thread
-    scraper_thread = threading.Thread(target=scraper_queue_thread, daemon=True)
-    scraper_thread.start()
+    start_scraper_thread()
     
     logger.info(f"\n{'='*60}")
     logger.info("🚀 WG-GESUCHT SCRAPER BACKEND STARTED")
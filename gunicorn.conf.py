@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration for WG-Gesucht Scraper Backend
+- Threaded workers reuse request threads
+- One worker by default: /stats and /scrape/trigger only work in the
+  process that runs the scraper queue, so with more workers they depend on
+  which one answers
+- Every worker tries to start the scraper queue; the lock file in
+  app.start_scraper_thread lets only one of them run it
+"""
+
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+
+def post_worker_init(worker):
+    """Start the scraper queue once the worker has loaded the app."""
+    from app import start_scraper_thread
+    start_scraper_thread()
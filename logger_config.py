@@ -3,11 +3,15 @@ Logging configuration for WG-Gesucht Scraper Backend
 - Rotates logs daily at midnight
 - Keeps only 3 days of logs (automatically deletes older files)
 - Logs to both file and console
+- Loggers only enqueue records; one listener thread writes them out, so
+  threads logging concurrently never wait on the file handler's lock
 """
 
+import atexit
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+import queue
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
 
 # Create logs directory if it doesn't exist
@@ -17,10 +21,37 @@ os.makedirs(LOGS_DIR, exist_ok=True)
 # Log filename with date
 LOG_FILE = os.path.join(LOGS_DIR, 'scraper.log')
 
+# Format for log messages
+formatter = logging.Formatter(
+    '%(asctime)s | %(levelname)-8s | %(name)s | %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# File handler - rotates daily, keeps 3 days of logs
+file_handler = TimedRotatingFileHandler(
+    LOG_FILE,
+    when='midnight',       # Rotate at midnight
+    interval=1,            # Every 1 day
+    backupCount=3,         # Keep only 3 days of logs
+    encoding='utf-8'
+)
+file_handler.setFormatter(formatter)
+file_handler.suffix = "%Y-%m-%d"  # Add date suffix to rotated files
+
+# Console handler - also show logs in terminal
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+# Shared by every logger; the listener thread is the only writer to the handlers
+LOG_QUEUE = queue.Queue(-1)
+listener = QueueListener(LOG_QUEUE, file_handler, console_handler)
+listener.start()
+atexit.register(listener.stop)  # flush queued records on shutdown
+
 
 def setup_logger(name: str = 'wg_scraper', level=logging.INFO):
     """
-    Setup logger with file and console handlers.
+    Setup logger that enqueues records for the shared file and console handlers.
     
     Args:
         name: Logger name
@@ -36,32 +67,7 @@ def setup_logger(name: str = 'wg_scraper', level=logging.INFO):
     if logger.handlers:
         return logger
     
-    # Format for log messages
-    formatter = logging.Formatter(
-        '%(asctime)s | %(levelname)-8s | %(name)s | %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
-    # File handler - rotates daily, keeps 3 days of logs
-    file_handler = TimedRotatingFileHandler(
-        LOG_FILE,
-        when='midnight',       # Rotate at midnight
-        interval=1,            # Every 1 day
-        backupCount=3,         # Keep only 3 days of logs
-        encoding='utf-8'
-    )
-    file_handler.setLevel(level)
-    file_handler.setFormatter(formatter)
-    file_handler.suffix = "%Y-%m-%d"  # Add date suffix to rotated files
-    
-    # Console handler - also show logs in terminal
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(level)
-    console_handler.setFormatter(formatter)
-    
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.addHandler(QueueHandler(LOG_QUEUE))
     
     return logger
 
@@ -0,0 +1,30 @@
+"""
+Production entrypoint for WG-Gesucht Scraper Backend
+- Serves the Flask app with waitress instead of Flask's development server
+- Reuses a fixed pool of worker threads across requests
+- Starts the background scraper thread once
+"""
+
+import os
+from waitress import serve
+from app import app, get_supabase, warm_up_supabase, start_scraper_thread
+from logger_config import setup_logger
+
+# Setup logger
+logger = setup_logger('serve')
+
+HOST = os.getenv('HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', '5001'))
+THREADS = int(os.getenv('WAITRESS_THREADS', '16'))  # request worker threads
+
+
+if __name__ == '__main__':
+    # Fail fast on missing credentials and open the connection up front
+    get_supabase()
+    warm_up_supabase()
+    
+    # Start background scraper thread
+    start_scraper_thread()
+    
+    logger.info(f"🌐 Serving with waitress on http://{HOST}:{PORT} ({THREADS} threads)")
+    serve(app, host=HOST, port=PORT, threads=THREADS)
@@ -1,13 +1,99 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import logging
+import orjson
 import os
-from datetime import datetime
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from operator import itemgetter
 from supabase import Client
 from logger_config import setup_logger
 
 # Setup logger
 logger = setup_logger('wg_scraper')
 
+CONTACT_CONCURRENCY = 5  # max offers contacted in parallel per account
+SESSION_RECHECK_SECONDS = 30 * 60  # re-validate the session mid-run only after this long
+RPM_LIMIT = int(os.getenv('WG_RPM_LIMIT', '30'))  # max API requests per client per minute
+OFFERS_PAGE_LIMIT = 50  # offers per page requested from asset/offers/
+MAX_OFFER_PAGES = int(os.getenv('MAX_OFFER_PAGES', '5'))  # upper bound on pages fetched per run
+MAX_RETRY_AFTER = 30  # seconds - cap on any server-requested wait (Retry-After)
+
+
+def encode_json(payload):
+    """Encode a request payload to JSON bytes with orjson (sent as-is via data=)."""
+    return orjson.dumps(payload)
+
+
+def decode_json(response):
+    """Decode a JSON response body with orjson (faster than response.json())."""
+    return orjson.loads(response.content)
+
+
+class ApiRetry(Retry):
+    """
+    Retry policy for WG-Gesucht API calls: exponential backoff on 429/5xx,
+    honoring Retry-After up to MAX_RETRY_AFTER seconds so a huge or bogus
+    header can't park a scraper thread.
+    
+    POSTs (login, contact) are only retried on 429, where the server did not
+    process the request - a 5xx might have, and retrying could send a message twice.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == 'POST' and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER)
+
+
+class AimdLimiter:
+    """
+    Adaptive cap on concurrent requests using AIMD (additive increase,
+    multiplicative decrease).
+    
+    Each success raises the limit by 0.5/limit (about +0.5 per full window of
+    requests); each 429/5xx halves it. Use as a context manager around a
+    request and report the outcome with record().
+    """
+
+    def __init__(self, initial: float = 2.0, minimum: float = 1.0, maximum: float = 10.0):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def record(self, status_code: int):
+        """Adjust the limit from a response status."""
+        with self._cond:
+            if status_code == 429 or status_code >= 500:
+                self.limit = max(self.minimum, self.limit * 0.5)
+            elif status_code < 400:
+                self.limit = min(self.maximum, self.limit + 0.5 / self.limit)
+            self._cond.notify_all()
+
 
 class WgGesuchtClient:
     """WG-Gesucht API Client with login, session management, and offer scraping."""
@@ -27,6 +113,10 @@ class WgGesuchtClient:
         self.accessToken = None
         self.refreshToken = None
         self.devRefNo = None
+        # Set when the API rejects the current tokens (HTTP 401); cleared once re-authenticated
+        self.needs_reauth = False
+        # Per-call auth headers, rebuilt only when the tokens change
+        self._auth_headers = {}
         
         # Setup proxy if provided
         self.proxies = None
@@ -35,37 +125,143 @@ class WgGesuchtClient:
                 'http': proxy_url,
                 'https': proxy_url
             }
-            logger.info(f"🔒 Proxy configured: {proxy_url.split('@')[-1] if '@' in proxy_url else proxy_url}")
-
-    # ---------------------------------------------------
-    # Generic API request
-    # ---------------------------------------------------
-    def request(self, method, endpoint, params=None, payload=None):
-        url = self.API_URL.format(endpoint)
-        headers = {
+            logger.info("🔒 Proxy configured: %s", proxy_url.split('@')[-1] if '@' in proxy_url else proxy_url)
+        
+        # One pooled session per client - keep-alive connections are reused
+        # across login, offer fetching and every contact request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=ApiRetry(
+            total=3,
+            connect=3,
+            read=0,  # a read timeout may mean the request was processed - don't resend
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST', 'PUT'}),
+            respect_retry_after_header=True,
+            raise_on_status=False  # hand the last response to request() for logging
+        ))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
             'X-App-Version': self.APP_VERSION,
             'User-Agent': self.USER_AGENT,
             'Content-Type': 'application/json',
             'Accept': 'application/json',
             'X-Client-Id': self.CLIENT_ID,
-        }
+            'Connection': 'keep-alive',
+        })
+        if self.proxies:
+            self.session.proxies.update(self.proxies)
+        
+        # Caps parallel requests (e.g. concurrent contacts); adapts to 429/5xx
+        # and keeps the learned limit for the lifetime of the client
+        self._limiter = AimdLimiter(maximum=CONTACT_CONCURRENCY)
+        
+        # Sliding window of request send times (time.monotonic) for RPM_LIMIT,
+        # plus a pause requested by the server (Retry-After / X-RateLimit-*)
+        self._request_times = deque()
+        self._throttled_until = 0.0
+        self._rate_lock = threading.Lock()
 
+    def close(self):
+        """Close the underlying HTTP session and its pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _update_auth_headers(self):
+        """Rebuild the cached auth headers after the tokens changed."""
         if self.accessToken:
-            headers['X-Authorization'] = f'Bearer {self.accessToken}'
-            headers['X-User-Id'] = self.userId
-            headers['X-Dev-Ref-No'] = self.devRefNo
+            self._auth_headers = {
+                'X-Authorization': f'Bearer {self.accessToken}',
+                'X-User-Id': self.userId,
+                'X-Dev-Ref-No': self.devRefNo
+            }
+        else:
+            self._auth_headers = {}
+
+    # ---------------------------------------------------
+    # Client-side rate limiting
+    # ---------------------------------------------------
+    def wait_if_throttled(self):
+        """Block until a request can be sent without exceeding RPM_LIMIT or a server-requested pause."""
+        while True:
+            with self._rate_lock:
+                now = time.monotonic()
+                while self._request_times and now - self._request_times[0] >= 60:
+                    self._request_times.popleft()
+                
+                wait = self._throttled_until - now
+                if len(self._request_times) >= RPM_LIMIT:
+                    wait = max(wait, 60 - (now - self._request_times[0]))
+                
+                if wait <= 0:
+                    self._request_times.append(now)
+                    return
+            
+            logger.info("⏳ Rate limit reached, waiting %.1fs before next request...", wait)
+            time.sleep(wait)
+
+    def _note_rate_limit_headers(self, response):
+        """Pause future requests (at most MAX_RETRY_AFTER seconds) if the server says the quota is used up."""
+        retry_after = response.headers.get('Retry-After')
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        
+        pause = None
+        if retry_after and retry_after.isdigit():
+            pause = min(int(retry_after), MAX_RETRY_AFTER)
+        elif remaining == '0':
+            pause = MAX_RETRY_AFTER
+        
+        if pause:
+            with self._rate_lock:
+                self._throttled_until = max(self._throttled_until, time.monotonic() + pause)
+
+    # ---------------------------------------------------
+    # Generic API request
+    # ---------------------------------------------------
+    def request(self, method, endpoint, params=None, payload=None):
+        """Send an API request. Returns the response on 2xx, None otherwise."""
+        response = self._send(method, endpoint, params, payload)
+        if response.status_code in range(200, 300):
+            return response
+        return None
+
+    def _send(self, method, endpoint, params=None, payload=None):
+        """Send an API request and return the response whatever its status (failures are logged)."""
+        url = self.API_URL.format(endpoint)
+        data = encode_json(payload) if payload is not None else None
 
-        response = requests.request(method, url, headers=headers, params=params, data=payload, proxies=self.proxies)
+        # Static headers (incl. Content-Type: application/json) live on the session;
+        # the cached auth headers are merged in per call
+        self.wait_if_throttled()
+        with self._limiter:
+            response = self.session.request(method, url, headers=self._auth_headers, params=params, data=data)
+        
+        # The adapter retries 429/5xx internally - feed those attempts to the
+        # limiter too, or a 429 followed by a 200 would only count as a success
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None:
+            for attempt in retries.history:
+                if attempt.status is not None:
+                    self._limiter.record(attempt.status)
+        self._limiter.record(response.status_code)
+        self._note_rate_limit_headers(response)
 
         if response.status_code in range(200, 300):
             return response
         
-        # if response.status_code == 401:
-        #     logger.error(f"❌ Session expired (401) for endpoint {endpoint}. Re-login required.")
-        #     return None
+        if response.status_code == 401:
+            self.needs_reauth = True
 
-        logger.error(f"❌ Request failed for {method} {endpoint}: {response.status_code} — {response.text[:200]}")
-        return None
+        # response.text decodes the whole body - only do it if the record is emitted
+        if logger.isEnabledFor(logging.ERROR):
+            logger.error("❌ Request failed for %s %s: %s — %s", method, endpoint, response.status_code, response.text[:200])
+        return response
 
     # ---------------------------------------------------
     # Login
@@ -79,12 +275,12 @@ class WgGesuchtClient:
             'display_language': 'de'
         }
 
-        r = self.request('POST', 'sessions', None, json.dumps(payload))
+        r = self.request('POST', 'sessions', None, payload)
         if not r:
             logger.error("❌ Login failed.")
             return False
 
-        response_data = r.json()
+        response_data = decode_json(r)
         
         # Check if 2FA is required (status 202)
         if response_data.get('status') == 202:
@@ -97,6 +293,8 @@ class WgGesuchtClient:
         self.refreshToken = body['refresh_token']
         self.userId = body['user_id']
         self.devRefNo = body['dev_ref_no']
+        self.needs_reauth = False
+        self._update_auth_headers()
         logger.info("✅ Logged in successfully.")
         return True
 
@@ -112,17 +310,19 @@ class WgGesuchtClient:
             'verification_code': verification_code
         }
 
-        r = self.request('POST', 'sessions/auth-verifications', None, json.dumps(payload))
+        r = self.request('POST', 'sessions/auth-verifications', None, payload)
 
         if not r:
             logger.error("❌ 2FA verification failed.")
             return False
 
-        body = r.json()['detail']
+        body = decode_json(r)['detail']
         self.accessToken = body['access_token']
         self.refreshToken = body['refresh_token']
         self.userId = body['user_id']
         self.devRefNo = body['dev_ref_no']
+        self.needs_reauth = False
+        self._update_auth_headers()
         logger.info("✅ 2FA verified successfully.")
         return True
 
@@ -146,27 +346,21 @@ class WgGesuchtClient:
 
         endpoint = f"sessions/users/{self.userId}"
         url = self.API_URL.format(endpoint)
-        headers = {
-            'X-App-Version': self.APP_VERSION,
-            'User-Agent': self.USER_AGENT,
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'X-Client-Id': self.CLIENT_ID,
-            'X-Authorization': f'Bearer {self.accessToken}',
-            'X-User-Id': self.userId,
-            'X-Dev-Ref-No': self.devRefNo
-        }
         
-        response = requests.put(url, headers=headers, data=json.dumps(payload), proxies=self.proxies)
+        self.wait_if_throttled()
+        response = self.session.put(url, headers=self._auth_headers, data=encode_json(payload))
         
         if response.status_code not in range(200, 300):
-            logger.error(f"❌ Token refresh failed: {response.status_code} — {response.text}")
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error("❌ Token refresh failed: %s — %s", response.status_code, response.text)
             return False
 
-        body = response.json()['detail']
+        body = decode_json(response)['detail']
         self.accessToken = body['access_token']
         self.refreshToken = body['refresh_token']
         self.devRefNo = body['dev_ref_no']
+        self.needs_reauth = False
+        self._update_auth_headers()
         logger.info("🔄 Token refreshed successfully.")
         return True
 
@@ -180,7 +374,7 @@ class WgGesuchtClient:
             'accessToken': self.accessToken,
             'refreshToken': self.refreshToken,
             'devRefNo': self.devRefNo,
-            'session_created_at': datetime.now().isoformat()
+            'session_created_at': datetime.now(timezone.utc).isoformat()
         }
 
     def set_session_from_dict(self, session_data):
@@ -189,6 +383,8 @@ class WgGesuchtClient:
         self.accessToken = session_data.get('accessToken')
         self.refreshToken = session_data.get('refreshToken')
         self.devRefNo = session_data.get('devRefNo')
+        self.needs_reauth = False
+        self._update_auth_headers()
 
     # ---------------------------------------------------
     # My Profile
@@ -203,7 +399,7 @@ class WgGesuchtClient:
         r = self.request('GET', endpoint)
         if not r:
             return None
-        return r.json()
+        return decode_json(r)
 
     # ---------------------------------------------------
     # Fetch all offers (LOGIN REQUIRED - Uses authenticated session)
@@ -230,8 +426,8 @@ class WgGesuchtClient:
         if rent_types is None:
             rent_types = [1, 2]  # Default: temporary and indefinite
             
-        categories_str = ','.join(map(str, categories))
-        rent_types_str = ','.join(map(str, rent_types))
+        categories_str = ','.join(str(c) for c in categories)
+        rent_types_str = ','.join(str(r) for r in rent_types)
         
         params = {
             'ad_type': '0',
@@ -240,7 +436,7 @@ class WgGesuchtClient:
             'city_id': cityId,
             'noDeact': '1',
             'img': '1',
-            'limit': '50',
+            'limit': str(OFFERS_PAGE_LIMIT),
             'page': page
         }
         
@@ -248,6 +444,10 @@ class WgGesuchtClient:
         if exclude_contacted:
             params['exContAds'] = '1'
         
+        # NOTE: asset/offers/ has no known "since"/date cursor parameter, so offers
+        # newer than last_latest are filtered client-side; offers_all_iter stops
+        # paging at the first page with nothing new instead
+        
         # Add optional filters
         if max_rent is not None and max_rent > 0:
             params['rMax'] = str(min(max_rent, 9999))  # Cap at 9999
@@ -260,16 +460,50 @@ class WgGesuchtClient:
         r = self.request('GET', endpoint, params=params)
         
         if not r:
-            logger.error(f"❌ Failed to fetch offers. Make sure you're logged in.")
+            logger.error("❌ Failed to fetch offers. Make sure you're logged in.")
             return None
         
-        return r.json()
+        return decode_json(r)
+
+    def offers_all_iter(self, cityId: str, categories: list = None, rent_types: list = None,
+                        exclude_contacted: bool = True, max_rent: int = None, min_size: int = None,
+                        max_pages: int = MAX_OFFER_PAGES):
+        """
+        Yield the offers of each result page, starting at page 1.
+        
+        Stops after an empty or short page, a failed request or max_pages.
+        The caller can stop earlier by breaking out of the loop, in which
+        case no further pages are requested.
+        """
+        for page in range(1, max_pages + 1):
+            raw_response = self.offers_all(
+                cityId=cityId,
+                categories=categories,
+                rent_types=rent_types,
+                page=str(page),
+                exclude_contacted=exclude_contacted,
+                max_rent=max_rent,
+                min_size=min_size
+            )
+            if not raw_response:
+                return
+            
+            offers = raw_response.get('_embedded', {}).get('offers', [])
+            yield offers
+            
+            if len(offers) < OFFERS_PAGE_LIMIT:
+                return
 
     # ---------------------------------------------------
     # Contact an Offer
     # ---------------------------------------------------
     def contact_offer(self, offerId: str, message: str):
-        """Send a message to a WG-Gesucht offer."""
+        """
+        Send a message to a WG-Gesucht offer.
+        
+        Returns (success, status_code) - the status tells callers whether a
+        failed contact is safe to resend (401) or may have been delivered (5xx).
+        """
         payload = {
             'user_id': self.userId,
             'ad_type': 0,
@@ -282,12 +516,12 @@ class WgGesuchtClient:
             ]
         }
 
-        r = self.request('POST', 'conversations', None, json.dumps(payload))
-        if not r:
-            logger.error(f"❌ Failed to contact offer {offerId} - Request failed (possibly 401/auth issue)")
-            return False
+        r = self._send('POST', 'conversations', None, payload)
+        if r.status_code not in range(200, 300):
+            logger.error("❌ Failed to contact offer %s - Request failed with status %s", offerId, r.status_code)
+            return False, r.status_code
 
-        return True
+        return True, r.status_code
 
 
 # ===================================================
@@ -298,9 +532,18 @@ def parse_date(date_str):
     """
     Convert WG-Gesucht date string to datetime object.
     Format: "22.10.2025, 17:15:01" (DD.MM.YYYY, HH:MM:SS)
+    
+    The format is fixed-width, so fields are sliced directly instead of
+    going through strptime's format parsing.
     """
     try:
-        return datetime.strptime(date_str, "%d.%m.%Y, %H:%M:%S")
+        if (len(date_str) != 20 or date_str[2] != '.' or date_str[5] != '.' or date_str[10:12] != ', '
+                or date_str[14] != ':' or date_str[17] != ':'):
+            return None
+        return datetime(
+            int(date_str[6:10]), int(date_str[3:5]), int(date_str[0:2]),
+            int(date_str[12:14]), int(date_str[15:17]), int(date_str[18:20])
+        )
     except Exception:
         return None
 
@@ -319,7 +562,7 @@ def ensure_valid_session(client: WgGesuchtClient, account: dict, supabase: Clien
     
     # No session at all - skip (session must be created from frontend)
     if not session_details:
-        logger.warning(f"⚠️ [{account['email']}] No session found. Session must be created from frontend first.")
+        logger.warning("⚠️ [%s] No session found. Session must be created from frontend first.", account['email'])
         return False
     
     # Load existing session
@@ -330,19 +573,22 @@ def ensure_valid_session(client: WgGesuchtClient, account: dict, supabase: Clien
     
     if session_created_str:
         try:
-            session_created = datetime.fromisoformat(session_created_str)
-            age_minutes = (datetime.now() - session_created).total_seconds() / 60
+            session_created = datetime.fromisoformat(session_created_str.replace('Z', '+00:00'))
+            if session_created.tzinfo is None:
+                # Older sessions were stamped with naive local time
+                session_created = session_created.astimezone(timezone.utc)
+            age_minutes = (datetime.now(timezone.utc) - session_created).total_seconds() / 60
             
-            logger.info(f"🕐 [{account['email']}] Session age: {age_minutes:.1f} minutes")
+            logger.info("🕐 [%s] Session age: %.1f minutes", account['email'], age_minutes)
             
             # If session is older than 40 minutes, refresh it proactively
             if age_minutes > 40:
-                logger.warning(f"⚠️ [{account['email']}] Session older than 40 minutes. Refreshing token...")
+                logger.warning("⚠️ [%s] Session older than 40 minutes. Refreshing token...", account['email'])
                 
                 if not client.refresh_session():
-                    logger.error(f"❌ [{account['email']}] Token refresh failed. Trying full re-login...")
+                    logger.error("❌ [%s] Token refresh failed. Trying full re-login...", account['email'])
                     if not client.login(account['email'], account['password']):
-                        logger.error(f"❌ [{account['email']}] Re-login also failed.")
+                        logger.error("❌ [%s] Re-login also failed.", account['email'])
                         return False
                 
                 # Update session in database
@@ -350,50 +596,61 @@ def ensure_valid_session(client: WgGesuchtClient, account: dict, supabase: Clien
                 supabase.table('accounts').update({
                     'session_details': new_session
                 }).eq('id', account['id']).execute()
-                logger.info(f"✅ [{account['email']}] Session refreshed and updated.")
+                logger.info("✅ [%s] Session refreshed and updated.", account['email'])
                 return True
             else:
-                logger.info(f"✅ [{account['email']}] Session is fresh (expires in ~{60 - age_minutes:.0f} minutes).")
+                logger.info("✅ [%s] Session is fresh (expires in ~%.0f minutes).", account['email'], 60 - age_minutes)
                 return True
                 
         except Exception as e:
-            logger.warning(f"⚠️ [{account['email']}] Could not parse session timestamp: {e}")
+            logger.warning("⚠️ [%s] Could not parse session timestamp: %s", account['email'], e)
     else:
-        logger.warning(f"⚠️ [{account['email']}] No session timestamp found.")
+        logger.warning("⚠️ [%s] No session timestamp found.", account['email'])
     
-    # Validate session with a simple profile check (as fallback)
-    logger.info(f"🔄 [{account['email']}] Validating existing session...")
-    if client.my_profile():
-        logger.info(f"✅ [{account['email']}] Existing session is valid.")
-        return True
+    # No usable timestamp: stamp one now and trust the token instead of probing
+    # the API. If it was already expired, the first real request gets a 401 and
+    # sets client.needs_reauth, which the callers handle
+    session_details = {**session_details, 'session_created_at': datetime.now(timezone.utc).isoformat()}
+    supabase.table('accounts').update({
+        'session_details': session_details
+    }).eq('id', account['id']).execute()
+    logger.info("📝 [%s] Session timestamp set, using existing session.", account['email'])
+    return True
+
+
+def reauthenticate(client: WgGesuchtClient, account: dict, supabase: Client) -> bool:
+    """
+    Replace a rejected session: try the refresh token first, then a full re-login.
+    Saves the new session to Supabase. Auto-disables the account if re-login needs 2FA.
     
-    # Session invalid - try refresh token first, then full login
-    logger.warning(f"⚠️ [{account['email']}] Session invalid. Attempting token refresh...")
+    Returns True if a new session was established.
+    """
+    logger.warning("⚠️ [%s] Session invalid. Attempting token refresh...", account['email'])
     if client.refresh_session():
         new_session = client.get_session_dict()
         supabase.table('accounts').update({
             'session_details': new_session
         }).eq('id', account['id']).execute()
-        logger.info(f"✅ [{account['email']}] Token refreshed and session updated.")
+        logger.info("✅ [%s] Token refreshed and session updated.", account['email'])
         return True
     
     # Refresh failed, try full re-login
-    logger.warning(f"⚠️ [{account['email']}] Token refresh failed. Re-logging in...")
+    logger.warning("⚠️ [%s] Token refresh failed. Re-logging in...", account['email'])
     login_result = client.login(account['email'], account['password'])
     
     # Check if 2FA is required - auto-disable account
     if login_result == 'MFA_REQUIRED':
-        logger.error(f"❌ [{account['email']}] 2FA required during auto-login. Auto-disabling account.")
+        logger.error("❌ [%s] 2FA required during auto-login. Auto-disabling account.", account['email'])
         config = account.get('configuration', {})
         config['scrape_enabled'] = False
         supabase.table('accounts').update({
             'configuration': config
         }).eq('id', account['id']).execute()
-        logger.error(f"🔴 [{account['email']}] Account disabled (scrape_enabled=false). Please re-login from frontend with 2FA.")
+        logger.error("🔴 [%s] Account disabled (scrape_enabled=false). Please re-login from frontend with 2FA.", account['email'])
         return False
     
     if not login_result:
-        logger.error(f"❌ [{account['email']}] Re-login failed.")
+        logger.error("❌ [%s] Re-login failed.", account['email'])
         return False
     
     # Update session in database
@@ -401,7 +658,7 @@ def ensure_valid_session(client: WgGesuchtClient, account: dict, supabase: Clien
     supabase.table('accounts').update({
         'session_details': new_session
     }).eq('id', account['id']).execute()
-    logger.info(f"✅ [{account['email']}] Re-logged in and session updated.")
+    logger.info("✅ [%s] Re-logged in and session updated.", account['email'])
     return True
 
 
@@ -409,22 +666,109 @@ def ensure_valid_session(client: WgGesuchtClient, account: dict, supabase: Clien
 # MAIN SCRAPER FUNCTION
 # ===================================================
 
+def contact_new_offers(client: WgGesuchtClient, account: dict, supabase: Client, new_offers: list,
+                       session_checked_at: float) -> int:
+    """
+    Send the account's 'message' to every new offer, CONTACT_CONCURRENCY at a time.
+    
+    The session validated before fetching offers (at session_checked_at, a
+    time.monotonic() value) is reused. It is only re-validated if the API has
+    rejected it since (401) or SESSION_RECHECK_SECONDS have passed. Offers that
+    failed because of a 401 are retried once after re-authenticating.
+    
+    Skips contacting if no message is set or no valid session can be established.
+    
+    Returns the number of offers contacted successfully.
+    """
+    contact_message = account.get('message')
+    
+    if not contact_message or not contact_message.strip():
+        logger.warning("⚠️ [%s] No message found. Skipping auto-contact.", account['email'])
+        return 0
+    
+    logger.info("💬 [%s] Auto-contacting %s new offers...", account['email'], len(new_offers))
+    
+    # Reuse the session from the offer fetch unless it was rejected or is getting old
+    if client.needs_reauth:
+        session_ok = reauthenticate(client, account, supabase)
+    elif time.monotonic() - session_checked_at > SESSION_RECHECK_SECONDS:
+        session_ok = ensure_valid_session(client, account, supabase)
+    else:
+        session_ok = True
+    
+    if not session_ok:
+        logger.error("❌ [%s] Could not establish valid session. Skipping auto-contact.", account['email'])
+        return 0
+    
+    def contact(offer):
+        offer_id = offer.get('offer_id')
+        offer_title = offer.get('title', 'Unknown')
+        offer_url = offer.get('url', '')
+        
+        logger.info("📤 [%s] Contacting offer %s: %s...", account['email'], offer_id, offer_title[:40])
+        logger.info("   🔗 URL: %s", offer_url)
+        
+        return client.contact_offer(offer_id, contact_message)
+    
+    def contact_all(offers):
+        """
+        Contact offers concurrently - bounded so bursts stay polite to WG-Gesucht.
+        Returns the failed ones as (offer, status_code) pairs; status_code is None on exceptions.
+        """
+        failed = []
+        with ThreadPoolExecutor(max_workers=CONTACT_CONCURRENCY) as executor:
+            future_to_offer = {executor.submit(contact, offer): offer for offer in offers}
+            
+            # Results are only collected here, in the submitting thread
+            for future in as_completed(future_to_offer):
+                offer = future_to_offer[future]
+                offer_id = offer.get('offer_id')
+                try:
+                    result, status_code = future.result()
+                except Exception as e:
+                    logger.error("   ❌ [%s] Error contacting offer %s: %s", account['email'], offer_id, e)
+                    result, status_code = False, None
+                
+                if result:
+                    logger.info("   ✅ [%s] Successfully contacted offer %s", account['email'], offer_id)
+                else:
+                    failed.append((offer, status_code))
+                    logger.error("   ❌ [%s] Failed to contact offer %s - Check logs above for details", account['email'], offer_id)
+        return failed
+    
+    failed_offers = contact_all(new_offers)
+    
+    # Session expired mid-run (401) - re-authenticate once and retry only the offers
+    # rejected with 401; others (e.g. 5xx) may have been delivered and aren't resent
+    rejected = [offer for offer, status_code in failed_offers if status_code == 401]
+    if rejected and client.needs_reauth:
+        logger.warning("⚠️ [%s] Session rejected during auto-contact. Retrying %s offers after re-authentication...", account['email'], len(rejected))
+        if reauthenticate(client, account, supabase):
+            failed_offers = [f for f in failed_offers if f[1] != 401] + contact_all(rejected)
+    
+    failed_count = len(failed_offers)
+    contacted_count = len(new_offers) - failed_count
+    
+    logger.info("📊 [%s] Contact Summary: ✅ %s | ❌ %s", account['email'], contacted_count, failed_count)
+    return contacted_count
+
+
 def run_scraper_for_account(account: dict, supabase: Client):
     """
     Run scraper for a single account from Supabase.
     
     - Logs in and scrapes listings (excludes already contacted ads via exContAds filter)
     - Filters ONLY offers newer than 'last_latest'
-    - FULLY REPLACES listing_data with new filtered offers
-    - Updates 'last_latest' to newest timestamp
     - AUTO-CONTACTS new offers if 'message' field is set
-    - Updates 'last_updated_at' timestamp
+    - FULLY REPLACES listing_data with new filtered offers
+    - Updates 'last_latest' to newest timestamp, 'contacted_ads' and
+      'last_updated_at' in a single write
     
     Returns: (success: bool, new_offers_count: int)
     """
-    logger.info(f"\n{'='*60}")
-    logger.info(f"🏃 Running scraper for: {account['email']}")
-    logger.info(f"{'='*60}")
+    logger.info("\n" + "=" * 60)
+    logger.info("🏃 Running scraper for: %s", account['email'])
+    logger.info("=" * 60)
     
     # Get configuration from account
     config = account.get('configuration', {})
@@ -440,203 +784,186 @@ def run_scraper_for_account(account: dict, supabase: Client):
         proxy_base = os.getenv('PROXY_URL')
         if proxy_base:
             proxy_url = f"{proxy_base}{proxy_port}"
-            logger.info(f"🔒 [{account['email']}] Using proxy port: {proxy_port}")
+            logger.info("🔒 [%s] Using proxy port: %s", account['email'], proxy_port)
         else:
-            logger.warning(f"⚠️ [{account['email']}] PROXY_URL not found in environment, running without proxy")
+            logger.warning("⚠️ [%s] PROXY_URL not found in environment, running without proxy", account['email'])
     else:
-        logger.info(f"ℹ️ [{account['email']}] No proxy port configured, running without proxy")
-    
-    # Initialize client with proxy
-    client = WgGesuchtClient(proxy_url=proxy_url)
-    
-    # Ensure valid session before scraping (required for exContAds filter)
-    logger.info(f"🔐 [{account['email']}] Logging in to access filtered listings...")
-    if not ensure_valid_session(client, account, supabase):
-        logger.error(f"❌ [{account['email']}] Could not establish valid session. Cannot fetch listings.")
-        return False, 0
-    
-    logger.info(f"🔍 [{account['email']}] Fetching offers from city_id={city_id}, categories={categories}...")
-    logger.info(f"🚫 [{account['email']}] Excluding already contacted ads (exContAds=1)")
-    if max_rent:
-        logger.info(f"💰 [{account['email']}] Max rent filter: {max_rent}€")
-    if min_size:
-        logger.info(f"📏 [{account['email']}] Min size filter: {min_size}m²")
-    
-    # Get rent_types from configuration (default: [1, 2] = temporary, indefinite)
-    rent_types = config.get('rent_types')
-    if rent_types:
-        logger.info(f"🏠 [{account['email']}] Rent types filter: {rent_types}")
-    
-    # Fetch offers (authenticated API with exContAds filter)
-    raw_response = client.offers_all(
-        cityId=city_id, 
-        categories=categories,
-        rent_types=rent_types,
-        exclude_contacted=True,
-        max_rent=max_rent,
-        min_size=min_size
-    )
-    if not raw_response:
-        logger.error(f"❌ [{account['email']}] No offers found or request failed.")
-        return False, 0
-    
-    # Extract offers array from response
-    offers = raw_response.get('_embedded', {}).get('offers', [])
-    logger.info(f"✅ [{account['email']}] Fetched {len(offers)} offers.")
-    
-    # Load existing listing_data to get previous last_latest
-    existing_listing_data = account.get('listing_data', {}) or {}
-    last_latest_str = existing_listing_data.get('last_latest')
-    last_latest_time = parse_date(last_latest_str) if last_latest_str else None
-    
-    # Extract latest timestamp from fetched offers
-    all_times = [
-        parse_date(o.get('date_of_entry_details'))
-        for o in offers
-        if o.get('date_of_entry_details')
-    ]
-    latest_time_in_fetch = max([t for t in all_times if t], default=None)
-    
-    # First run: initialize
-    if not last_latest_time:
-        # Format: "22.10.2025, 17:15:01" - EXACT format from WG-Gesucht API
-        latest_str = (
-            latest_time_in_fetch.strftime("%d.%m.%Y, %H:%M:%S")
-            if latest_time_in_fetch
-            else None
-        )
-        new_listing_data = {
-            "last_latest": latest_str,
-            "offers": []
-        }
+        logger.info("ℹ️ [%s] No proxy port configured, running without proxy", account['email'])
+    
+    # Initialize client with proxy (its HTTP session is closed when the run ends)
+    with WgGesuchtClient(proxy_url=proxy_url) as client:
+        # Ensure valid session before scraping (required for exContAds filter)
+        logger.info("🔐 [%s] Logging in to access filtered listings...", account['email'])
+        if not ensure_valid_session(client, account, supabase):
+            logger.error("❌ [%s] Could not establish valid session. Cannot fetch listings.", account['email'])
+            return False, 0
+        session_checked_at = time.monotonic()
         
-        supabase.table('accounts').update({
-            'listing_data': new_listing_data,
-            'last_updated_at': datetime.now().isoformat()
-        }).eq('id', account['id']).execute()
+        logger.info("🔍 [%s] Fetching offers from city_id=%s, categories=%s...", account['email'], city_id, categories)
+        logger.info("🚫 [%s] Excluding already contacted ads (exContAds=1)", account['email'])
+        if max_rent:
+            logger.info("💰 [%s] Max rent filter: %s€", account['email'], max_rent)
+        if min_size:
+            logger.info("📏 [%s] Min size filter: %sm²", account['email'], min_size)
         
-        logger.info(f"🆕 [{account['email']}] Initialized listing_data with last_latest: {latest_str}")
-        logger.info(f"    Next run will save only newer listings.")
-        return True, 0
-    
-    # Subsequent runs: filter only listings newer than last_latest
-    logger.info(f"📌 [{account['email']}] Previous last_latest: {last_latest_str}")
-    
-    new_offers = []
-    for o in offers:
-        date_str = o.get('date_of_entry_details')
-        offer_time = parse_date(date_str)
-        if not offer_time:
-            continue
-        
-        if offer_time > last_latest_time:
-            formatted = {
-                "offer_id": o.get('offer_id'),
-                "title": o.get('offer_title'),
-                "user_id": o.get('user_id'),
-                "public_name": o.get('user_data', {}).get('public_name'),
-                "date_of_entry_details": date_str,
-                "url": f"{WgGesuchtClient.BASE_URL}/{o.get('offer_id')}.html"
-            }
-            new_offers.append(formatted)
-    
-    if not new_offers:
-        logger.info(f"✅ [{account['email']}] No new listings found — everything is up to date.")
-        # Still update last_updated_at
-        supabase.table('accounts').update({
-            'last_updated_at': datetime.now().isoformat()
-        }).eq('id', account['id']).execute()
-        return True, 0
-    
-    # Update "last_latest" to the newest time found in new offers
-    newest_time = max(parse_date(o['date_of_entry_details']) for o in new_offers)
-    # Format: "22.10.2025, 17:15:01" - EXACT format from WG-Gesucht API
-    newest_str = newest_time.strftime("%d.%m.%Y, %H:%M:%S")
-    
-    # Sort new offers by date descending
-    new_offers = sorted(
-        new_offers,
-        key=lambda x: parse_date(x['date_of_entry_details']) or datetime.min,
-        reverse=True
-    )
-    
-    # FULLY REPLACE listing_data with ONLY new filtered listings
-    updated_listing_data = {
-        "last_latest": newest_str,
-        "offers": new_offers
-    }
-    
-    # Save to Supabase first
-    try:
-        supabase.table('accounts').update({
-            'listing_data': updated_listing_data,
-            'last_updated_at': datetime.now().isoformat()
-        }).eq('id', account['id']).execute()
+        # Get rent_types from configuration (default: [1, 2] = temporary, indefinite)
+        rent_types = config.get('rent_types')
+        if rent_types:
+            logger.info("🏠 [%s] Rent types filter: %s", account['email'], rent_types)
         
-        logger.info(f"🆕 [{account['email']}] Added {len(new_offers)} new offers.")
-        logger.info(f"📅 [{account['email']}] Updated last_latest → {newest_str}")
+        # Load existing listing_data to get previous last_latest
+        existing_listing_data = account.get('listing_data', {}) or {}
+        last_latest_str = existing_listing_data.get('last_latest')
+        last_latest_time = parse_date(last_latest_str) if last_latest_str else None
         
-    except Exception as e:
-        logger.error(f"❌ [{account['email']}] Error saving to Supabase: {e}")
-        return False, 0
-    
-    # ===================================================
-    # AUTO-CONTACT NEW OFFERS
-    # ===================================================
-    
-    contact_message = account.get('message')
-    
-    if not contact_message or not contact_message.strip():
-        logger.warning(f"⚠️ [{account['email']}] No message found. Skipping auto-contact.")
-        return True, len(new_offers)
-    
-    # Ensure valid session (auto-login if expired)
-    logger.info(f"💬 [{account['email']}] Auto-contacting {len(new_offers)} new offers...")
-    
-    if not ensure_valid_session(client, account, supabase):
-        logger.error(f"❌ [{account['email']}] Could not establish valid session. Skipping auto-contact.")
-        return True, len(new_offers)
-    
-    # Contact each offer
-    contacted_count = 0
-    failed_count = 0
-    
-    for offer in new_offers:
-        offer_id = offer.get('offer_id')
-        offer_title = offer.get('title', 'Unknown')
-        offer_url = offer.get('url', '')
+        def fetch_offers():
+            """
+            Fetch offers page by page (authenticated API with exContAds filter).
+            Every entry date is parsed once - reused for latest time, filtering and sorting.
+            Offers repeated on a later page (new ads shift the listing between page
+            requests) are skipped, so they aren't contacted twice.
+            
+            Returns (parsed, pages_fetched).
+            """
+            parsed = []
+            seen = set()
+            pages_fetched = 0
+            for page_offers in client.offers_all_iter(
+                cityId=city_id,
+                categories=categories,
+                rent_types=rent_types,
+                exclude_contacted=True,
+                max_rent=max_rent,
+                min_size=min_size
+            ):
+                pages_fetched += 1
+                page_parsed = [(o, parse_date(o.get('date_of_entry_details'))) for o in page_offers]
+                for o, t in page_parsed:
+                    offer_id = o.get('offer_id')
+                    if offer_id not in seen:
+                        seen.add(offer_id)
+                        parsed.append((o, t))
+                
+                # First run only needs the newest offer; otherwise stop once a
+                # whole page is already known
+                if not last_latest_time or all(t is None or t <= last_latest_time for _, t in page_parsed):
+                    break
+            return parsed, pages_fetched
         
-        logger.info(f"📤 [{account['email']}] Contacting offer {offer_id}: {offer_title[:40]}...")
-        logger.info(f"   🔗 URL: {offer_url}")
+        parsed, pages_fetched = fetch_offers()
         
-        result = client.contact_offer(offer_id, contact_message)
+        # Token rejected (e.g. an untimestamped session that had expired): re-authenticate once and retry
+        if not pages_fetched and client.needs_reauth:
+            if not reauthenticate(client, account, supabase):
+                return False, 0
+            session_checked_at = time.monotonic()
+            parsed, pages_fetched = fetch_offers()
         
-        if result:
-            contacted_count += 1
-            logger.info(f"   ✅ [{account['email']}] Successfully contacted offer {offer_id}")
-        else:
-            failed_count += 1
-            logger.error(f"   ❌ [{account['email']}] Failed to contact offer {offer_id} - Check logs above for details")
-    
-    # Update the contacted_ads counter in configuration
-    if contacted_count > 0:
-        try:
-            config = account.get('configuration', {})
-            current_contacted = config.get('contacted_ads', 0)
-            new_total = current_contacted + contacted_count
+        if not pages_fetched:
+            logger.error("❌ [%s] No offers found or request failed.", account['email'])
+            return False, 0
+        
+        logger.info("✅ [%s] Fetched %s offers from %s page(s).", account['email'], len(parsed), pages_fetched)
+        
+        # Extract latest timestamp from fetched offers
+        latest_time_in_fetch = max((t for _, t in parsed if t), default=None)
+        
+        # First run: initialize
+        if not last_latest_time:
+            # Format: "22.10.2025, 17:15:01" - EXACT format from WG-Gesucht API
+            latest_str = (
+                latest_time_in_fetch.strftime("%d.%m.%Y, %H:%M:%S")
+                if latest_time_in_fetch
+                else None
+            )
+            new_listing_data = {
+                "last_latest": latest_str,
+                "offers": []
+            }
             
-            config['contacted_ads'] = new_total
+            supabase.table('accounts').update({
+                'listing_data': new_listing_data,
+                'last_updated_at': datetime.now(timezone.utc).isoformat()
+            }).eq('id', account['id']).execute()
+            
+            logger.info("🆕 [%s] Initialized listing_data with last_latest: %s", account['email'], latest_str)
+            logger.info("    Next run will save only newer listings.")
+            return True, 0
+        
+        # Subsequent runs: filter only listings newer than last_latest
+        logger.info("📌 [%s] Previous last_latest: %s", account['email'], last_latest_str)
+        
+        new_offers = []
+        url_prefix = WgGesuchtClient.BASE_URL + '/'
+        for o, offer_time in parsed:
+            if not offer_time:
+                continue
             
+            if offer_time > last_latest_time:
+                formatted = {
+                    "offer_id": o.get('offer_id'),
+                    "title": o.get('offer_title'),
+                    "user_id": o.get('user_id'),
+                    "public_name": o.get('user_data', {}).get('public_name'),
+                    "date_of_entry_details": o.get('date_of_entry_details'),
+                    "url": url_prefix + str(o.get('offer_id')) + '.html',
+                    "_dt": offer_time  # parsed date, removed before saving
+                }
+                new_offers.append(formatted)
+        
+        if not new_offers:
+            logger.info("✅ [%s] No new listings found — everything is up to date.", account['email'])
+            # Still update last_updated_at
             supabase.table('accounts').update({
-                'configuration': config
+                'last_updated_at': datetime.now(timezone.utc).isoformat()
             }).eq('id', account['id']).execute()
+            return True, 0
+        
+        # Update "last_latest" to the newest time found in new offers - that is the
+        # newest time of the whole fetch, since every newer offer is a new offer
+        newest_time = latest_time_in_fetch
+        # Format: "22.10.2025, 17:15:01" - EXACT format from WG-Gesucht API
+        newest_str = newest_time.strftime("%d.%m.%Y, %H:%M:%S")
+        
+        # Sort new offers by date descending
+        new_offers.sort(key=itemgetter('_dt'), reverse=True)
+        for o in new_offers:
+            o.pop('_dt', None)
+        
+        # FULLY REPLACE listing_data with ONLY new filtered listings
+        updated_listing_data = {
+            "last_latest": newest_str,
+            "offers": new_offers
+        }
+        
+        # ===================================================
+        # AUTO-CONTACT NEW OFFERS
+        # ===================================================
+        
+        contacted_count = contact_new_offers(client, account, supabase, new_offers, session_checked_at)
+        
+        # Save everything in a single write: listing_data, last_updated_at and contacted_ads
+        update = {
+            'listing_data': updated_listing_data,
+            'last_updated_at': datetime.now(timezone.utc).isoformat()
+        }
+        if contacted_count > 0:
+            config = account.get('configuration', {})
+            current_contacted = config.get('contacted_ads', 0)
+            update['configuration'] = {**config, 'contacted_ads': current_contacted + contacted_count}
+        
+        try:
+            supabase.table('accounts').update(update).eq('id', account['id']).execute()
+            
+            logger.info("🆕 [%s] Added %s new offers.", account['email'], len(new_offers))
+            logger.info("📅 [%s] Updated last_latest → %s", account['email'], newest_str)
+            if contacted_count > 0:
+                logger.info("📈 [%s] Updated contacted_ads: %s → %s", account['email'], current_contacted, current_contacted + contacted_count)
             
-            logger.info(f"📈 [{account['email']}] Updated contacted_ads: {current_contacted} → {new_total}")
         except Exception as e:
-            logger.error(f"❌ [{account['email']}] Error updating contacted_ads counter: {e}")
-    
-    logger.info(f"📊 [{account['email']}] Contact Summary: ✅ {contacted_count} | ❌ {failed_count}")
-    logger.info(f"✅ [{account['email']}] Scraper completed successfully!")
-    
-    return True, len(new_offers)
-
+            logger.error("❌ [%s] Error saving to Supabase: %s", account['email'], e)
+            return False, 0
+        
+        logger.info("✅ [%s] Scraper completed successfully!", account['email'])
+        
+        return True, len(new_offers)